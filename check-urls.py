@@ -1,26 +1,70 @@
+import argparse
 import asyncio
+import aiofiles
 import aiohttp
 import csv
+import logging
 import os
+import sys
+from contextlib import ExitStack
 from datetime import datetime, timedelta
-from typing import List, Tuple, Any
+from typing import List, Tuple, Any, AsyncIterable, AsyncIterator, NamedTuple, Optional
 from aiohttp import ClientTimeout
-from tenacity import retry, stop_after_attempt, wait_exponential
+from aiocsv import AsyncReader
+
+# Status codes returned by servers that refuse or mishandle HEAD; these are retried with GET
+HEAD_FALLBACK_STATUSES = (403, 405, 501)
+
+# URLs with these schemes cannot be checked over HTTP and are reported as skipped
+SKIPPED_SCHEMES = frozenset({'mailto', 'tel', 'javascript'})
+SKIPPED_STATUS = "skipped"
+
+# 1 MB buffer for report files so rows are flushed in large writes
+WRITE_BUFFER_SIZE = 1 << 20
+
+log = logging.getLogger(__name__)
+
+class CheckResult(NamedTuple):
+    """
+    Result of checking one URL. The first five fields form the report row;
+    ok (not reported as broken) and is_404 are classified once when the result is made.
+    """
+    url: str
+    status: Any
+    content_type: Optional[str]
+    parent_url: str
+    line: int
+    ok: bool
+    is_404: bool
+
+REPORT_FIELDS = 5  # Number of CheckResult fields written to the report files
+
+def make_result(url: str, status: Any, content_type: Optional[str], parent_url: str, line_number: int) -> CheckResult:
+    """
+    Build a CheckResult, classifying the status once
+    """
+    return CheckResult(url, status, content_type, parent_url, line_number,
+                       ok=status == 200 or status == SKIPPED_STATUS,
+                       is_404=status == 404)
 
 class URLChecker:
     def __init__(self, 
                  max_retries: int = 3,
                  timeout_seconds: int = 10,
                  max_concurrent: int = 50,
+                 max_per_host: int = 10,
                  retry_delay: int = 1):
         """
         Initialize URL checker with configurable parameters for request handling
         """
-        self.max_retries = max_retries
-        self.timeout = ClientTimeout(total=timeout_seconds)
-        self.max_concurrent = max_concurrent
+        self.max_retries = max(1, max_retries)  # Always make at least one attempt
+        self.timeout_seconds = timeout_seconds
+        # Time out on socket activity only, so waiting for a free pooled connection is not counted
+        self.timeout = ClientTimeout(total=None, sock_connect=timeout_seconds, sock_read=timeout_seconds)
+        self.max_concurrent = max_concurrent  # Enforced by the connector's connection limit
+        self.max_per_host = max_per_host
         self.retry_delay = retry_delay
-        self.semaphore = asyncio.Semaphore(max_concurrent)  # Initialize semaphore
+        self.session = None  # Shared ClientSession, created in __aenter__
 
         # Get GitHub Actions context
         run_id = os.environ.get('GITHUB_RUN_ID', 'unknown')
@@ -41,75 +85,147 @@ class URLChecker:
             'Pragma': 'no-cache',
         }
 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=4, max=10),
-        retry_error_callback=lambda retry_state: (
-            retry_state.args[0],  # url
-            f'Failed after {retry_state.attempt_number} attempts: {str(retry_state.outcome.exception())}',
-            None,  # content-type
-            retry_state.args[1],  # parent_url
-            retry_state.args[2]   # line_number
+    async def __aenter__(self):
+        """
+        Create one shared session so connections, DNS lookups and TLS sessions are reused across URLs
+        """
+        connector = aiohttp.TCPConnector(
+            limit=self.max_concurrent,
+            limit_per_host=self.max_per_host,
+            ttl_dns_cache=300,
+            enable_cleanup_closed=True
         )
-    )
-    async def check_single_url(self, url: str, parent_url: str, line_number: int) -> Tuple[str, Any, str, str, int]:
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=self.timeout,
+            headers=self.headers
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+        self.session = None
+
+    async def check_single_url(self, url: str, parent_url: str, line_number: int) -> CheckResult:
         """
         Check a single URL with retry logic and error handling
-        Returns: Tuple of (url, status_code, content_type, parent_url, line_number)
+        Timeouts and connection errors are retried up to max_retries attempts with exponential backoff
+        Returns: CheckResult of (url, status_code, content_type, parent_url, line_number, ok, is_404)
         """
-        print(f"Processing line {line_number}: {url}")
-        async with self.semaphore:  # Control concurrent connections
+        log.debug("Processing line %d: %s", line_number, url)
+        # Split on the first ':' rather than parsing, so malformed URLs still reach the
+        # request below and are reported as errors; anything else is checked and reported
+        if url.partition(':')[0].strip().lower() in SKIPPED_SCHEMES:
+            return make_result(url, SKIPPED_STATUS, None, parent_url, line_number)
+
+        for attempt in range(1, self.max_retries + 1):
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(
-                        url, 
-                        timeout=self.timeout,
-                        allow_redirects=True,
-                        ssl=False,
-                        headers=self.headers
-                    ) as response:
-                        content_type = response.headers.get('Content-Type', 'Unknown')
-                        return url, response.status, content_type, parent_url, line_number
+                status, content_type = await self.fetch_status(url)
+                return make_result(url, status, content_type, parent_url, line_number)
             except asyncio.TimeoutError:
-                return url, f"Timeout after {self.timeout.total} seconds", None, parent_url, line_number
+                error = f"Timeout after {self.timeout_seconds} seconds"
             except aiohttp.ClientError as e:
-                return url, f"Connection error: {str(e)}", None, parent_url, line_number
+                error = f"Connection error: {str(e)}"
             except Exception as e:
-                return url, f"Unexpected error: {str(e)}", None, parent_url, line_number
+                return make_result(url, f"Unexpected error: {str(e)}", None, parent_url, line_number)
+
+            if attempt < self.max_retries:
+                await asyncio.sleep(min(10, self.retry_delay * 2 ** (attempt - 1)))
+
+        return make_result(url, f"Failed after {self.max_retries} attempts: {error}", None, parent_url, line_number)
 
-    async def check_urls_batch(self, links: List[List[str]], batch_size: int = 1000) -> List[Tuple[str, Any, str, str, int]]:
+    async def fetch_status(self, url: str) -> Tuple[int, str]:
         """
-        Process URLs in batches to prevent memory issues
+        Get the status code and content type of a URL without downloading the body.
+        Uses HEAD first and falls back to GET for servers that reject HEAD. Any other 4xx answer
+        to HEAD is also confirmed with GET, since servers that mishandle HEAD often answer 404
+        or 400 to pages that exist. The body is never read on either path, so large HTML/PDF
+        targets are not buffered in memory and the connection is released as soon as the
+        headers arrive.
+        Content types are interned since only a few distinct values recur across many results.
+        """
+        async with self.session.head(url, allow_redirects=True, ssl=False) as response:
+            # Keep the HEAD result unless it is a client error or a sign the server rejects HEAD
+            if response.status < 400 or (response.status >= 500 and response.status not in HEAD_FALLBACK_STATUSES):
+                return response.status, sys.intern(response.headers.get('Content-Type', 'Unknown'))
+
+        async with self.session.get(url, allow_redirects=True, ssl=False) as response:
+            return response.status, sys.intern(response.headers.get('Content-Type', 'Unknown'))
+
+    async def check_urls(self, links: AsyncIterable[List[str]]) -> AsyncIterator[List[CheckResult]]:
         """
-        all_results = []
-        for i in range(0, len(links), batch_size):
-            batch = links[i:i + batch_size]
-            tasks = [
+        Check URLs streamed from the input rows, keeping at most max_concurrent requests in flight.
+        Yields lists of results as requests complete so memory stays bounded regardless of input size
+        """
+        pending = set()
+        line_number = 1  # Line 1 of the input file is the header row
+        async for link in links:
+            line_number += 1
+            if not link:
+                continue
+            pending.add(asyncio.create_task(
                 self.check_single_url(
-                    link[0], 
-                    link[1] if len(link) > 1 else "N/A",
-                    i + idx + 2
-                ) 
-                for idx, link in enumerate(batch)
-            ]
-            batch_results = await asyncio.gather(*tasks)
-            all_results.extend(batch_results)
-            print(f"\nBatch complete: Processed {min(i + batch_size, len(links))}/{len(links)} URLs")
-        return all_results
-
-async def process_and_write_batch(checker: URLChecker, batch: List[List[str]], writers: dict, batch_number: int, total_batches: int) -> List[Tuple[str, Any, str, str, int]]:
-    print(f"\nProcessing batch {batch_number}/{total_batches}")
-    results = await checker.check_urls_batch(batch)
-    
-    for result in results:
-        url, status, content_type, parent_url, line_number = result
-        writers['main'].writerow([url, status, content_type, parent_url, line_number])
-        if isinstance(status, int) and status == 404:
-            writers['404'].writerow([url, status, content_type, parent_url, line_number])
+                    link[0],
+                    # A parent page can link to thousands of URLs, so share one string per parent
+                    sys.intern(link[1]) if len(link) > 1 else "N/A",
+                    line_number
+                )
+            ))
+            if len(pending) >= self.max_concurrent:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                yield [task.result() for task in done]
+
+        if pending:
+            done, _ = await asyncio.wait(pending)
+            yield [task.result() for task in done]
+
+# Column headings for CSV reports; JSONL reports use the CheckResult field names as keys
+REPORT_HEADER = ['URL', 'Status Code', 'Content-Type', 'Parent URL', 'Input Line']
+JSONL_KEYS = CheckResult._fields[:REPORT_FIELDS]
+
+class JSONLWriter:
+    """
+    Writes report rows as JSON Lines using orjson, with the same writerows interface as csv.writer
+    """
+    def __init__(self, jsonl_file):
+        # orjson is only needed for JSONL reports, so CSV runs work without it installed
+        import orjson
+        self.dumps = orjson.dumps
+        self.jsonl_file = jsonl_file
+
+    def writerows(self, rows):
+        self.jsonl_file.write(b''.join(self.dumps(dict(zip(JSONL_KEYS, row))) + b'\n' for row in rows))
+
+def open_report(path: str, report_format: str):
+    """
+    Open a report file for writing in the given format (CSV with a header row, or JSONL)
+    Returns: Tuple of (file, writer)
+    """
+    if report_format == "JSONL":
+        jsonl_file = open(path, 'wb', buffering=WRITE_BUFFER_SIZE)
+        try:
+            return jsonl_file, JSONLWriter(jsonl_file)
+        except ImportError:
+            jsonl_file.close()
+            raise
+
+    csv_file = open(path, 'w', newline='', encoding='utf-8', buffering=WRITE_BUFFER_SIZE)
+    writer = csv.writer(csv_file)
+    writer.writerow(REPORT_HEADER)
+    return csv_file, writer
+
+def process_and_write_batch(results: List[CheckResult], writers: dict) -> List[CheckResult]:
+    # Write each group of completed results with a single writerows call per file
+    writers['main'].writerows([result[:REPORT_FIELDS] for result in results])
+    writers['404'].writerows([result[:REPORT_FIELDS] for result in results if result.is_404])
     
     return results
 
 async def main():
+    parser = argparse.ArgumentParser(description="Check the status of collected links.")
+    parser.add_argument("--format", choices=["CSV", "JSONL"], default="CSV", help="Report format (JSONL is faster for very large runs)")
+    args = parser.parse_args()
+
     # Set up file paths and ensure directories exist
     date = datetime.now().strftime('%Y-%m-%d')
     old_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
@@ -117,78 +233,61 @@ async def main():
     if not links_file:
         links_file = f"reports/get-links-{old_date}.csv"
     os.makedirs('reports', exist_ok=True)
+    github_env = os.environ.get('GITHUB_ENV', 'env.txt')
+    github_output = os.environ.get('GITHUB_OUTPUT', 'github_output.txt')
     
-    # Initialize URL checker
-    checker = URLChecker(
+    # Report file names follow the chosen format
+    extension = args.format.lower()
+    report_file = f"reports/check-links-report-{date}.{extension}"
+    report_404_file = f"reports/check-links-404-report-{date}.{extension}"
+    
+    # Initialize URL checker; the shared session lives for the whole run
+    async with URLChecker(
         max_retries=3,
         timeout_seconds=15,
         max_concurrent=50,
+        max_per_host=10,
         retry_delay=1
-    )
-
-    # Open report files and create CSV writers
-    report_file = f"reports/check-links-report-{date}.csv"
-    report_404_file = f"reports/check-links-404-report-{date}.csv"
-    
-    with open(report_file, 'w', newline='', encoding='utf-8') as main_csvfile, \
-         open(report_404_file, 'w', newline='', encoding='utf-8') as file_404_csvfile:
-        
-        writers = {
-            'main': csv.writer(main_csvfile),
-            '404': csv.writer(file_404_csvfile)
-        }
+    ) as checker:
+        # Open report files and create writers
+        with ExitStack() as report_files:
+            # Register each file as soon as it is open so it is closed if the next open fails
+            main_report, main_writer = open_report(report_file, args.format)
+            report_files.enter_context(main_report)
+            report_404, writer_404 = open_report(report_404_file, args.format)
+            report_files.enter_context(report_404)
         
-        # Write headers
-        for writer in writers.values():
-            writer.writerow(['URL', 'Status Code', 'Content-Type', 'Parent URL', 'Input Line'])
-
-        # Process links in batches
-        batch_size = 1000
-        broken_links = []
-        batch_number = 0
-        total_links = 0
-
-        with open(links_file, 'r', newline='', encoding='utf-8') as csvfile:
-            reader = csv.reader(csvfile)
-            next(reader)  # Skip header row
-
-            batch = []
-            for row in reader:
-                batch.append(row)
-                total_links += 1
-                
-                if len(batch) == batch_size:
-                    batch_number += 1
-                    results = await process_and_write_batch(checker, batch, writers, batch_number, (total_links + batch_size - 1) // batch_size)
-                    
-                    # Check for broken links in the batch
-                    broken_links.extend([
-                        (url, line_num) 
-                        for url, status, _, _, line_num in results 
-                        if isinstance(status, (int, str)) and (not isinstance(status, int) or status != 200)
-                    ])
+            writers = {
+                'main': main_writer,
+                '404': writer_404
+            }
+
+            # Stream links from the input file, writing results as they complete
+            progress_every = 500
+            broken_links = []
+            processed = 0
+
+            # Read the input asynchronously so disk reads interleave with URL checks
+            async with aiofiles.open(links_file, 'r', newline='', encoding='utf-8') as csvfile:
+                reader = AsyncReader(csvfile)
+                await reader.__anext__()  # Skip header row
+
+                async for results in checker.check_urls(reader):
+                    process_and_write_batch(results, writers)
                     
-                    batch = []  # Reset batch
-
-            # Process any remaining links
-            if batch:
-                batch_number += 1
-                results = await process_and_write_batch(checker, batch, writers, batch_number, (total_links + batch_size - 1) // batch_size)
-                
-                # Check for broken links in the final batch
-                broken_links.extend([
-                    (url, line_num) 
-                    for url, status, _, _, line_num in results 
-                    if isinstance(status, (int, str)) and (not isinstance(status, int) or status != 200)
-                ])
+                    # Check for broken links in the completed results
+                    broken_links.extend([(result.url, result.line) for result in results if not result.ok])
+
+                    # Report progress periodically rather than per URL
+                    if (processed + len(results)) // progress_every > processed // progress_every:
+                        log.info("Processed %d URLs", processed + len(results))
+                    processed += len(results)
+
+            log.info("Processing complete: %d URLs checked", processed)
 
     # Set environment variables and output results
     print(f"\nREPORT_FILE={report_file}")
     print(f"REPORT_404_FILE={report_404_file}")
-    
-    with open(os.environ.get('GITHUB_ENV', 'env.txt'), 'a') as env_file:
-        env_file.write(f"REPORT_FILE={report_file}\n")
-        env_file.write(f"REPORT_404_FILE={report_404_file}\n")
 
     if broken_links:
         print("\nBroken links found in lines:")
@@ -197,13 +296,30 @@ async def main():
     
     message = "Broken links detected." if broken_links else "No broken links found."
     
-    github_output = os.environ.get('GITHUB_OUTPUT', 'github_output.txt')
-    with open(github_output, 'a') as f:
-        f.write(f"broken_links_found={'true' if broken_links else 'false'}\n")
-
-    github_env = os.environ.get('GITHUB_ENV', 'github_env.txt')
+    # Append all entries to each GitHub Actions file in a single write
+    env_entries = {
+        'REPORT_FILE': report_file,
+        'REPORT_404_FILE': report_404_file,
+        'STATUS_MESSAGE': message,
+    }
+    output_entries = {
+        'broken_links_found': 'true' if broken_links else 'false',
+    }
     with open(github_env, 'a') as f:
-        f.write(f"STATUS_MESSAGE={message}\n")
+        f.write(''.join(f"{key}={value}\n" for key, value in env_entries.items()))
+    with open(github_output, 'a') as f:
+        f.write(''.join(f"{key}={value}\n" for key, value in output_entries.items()))
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # Quiet by default; set LOGLEVEL=INFO (e.g. in CI) for progress or DEBUG for per-URL output
+    log_level = os.environ.get('LOGLEVEL', 'WARNING').upper()
+    if not isinstance(logging.getLevelName(log_level), int):
+        log_level = 'WARNING'  # Ignore unknown levels rather than failing the run
+    logging.basicConfig(level=log_level, format='%(message)s')
+    # Use the libuv-based event loop where available (uvloop does not support Windows)
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
@@ -1,90 +1,265 @@
 """
 This script crawls a website and collects links, similar to the linkinator tool.
 It performs recursive crawling and saves the collected links to a CSV file.
-Usage: python script.py [--recurse] [--format CSV]
+Usage: python script.py [--recurse] [--js] [--format CSV]
 """
 
 import asyncio
 import csv
 import os
 import argparse
-from urllib.parse import urljoin, urlparse
-from playwright.async_api import async_playwright
+import sqlite3
+from contextlib import AsyncExitStack
+from functools import partial
+from urllib.parse import urljoin, urlparse, urlsplit
+import aiohttp
+from aiohttp import ClientTimeout
+from selectolax.lexbor import LexborHTMLParser
 from datetime import datetime
 
+# Only links with these schemes are collected
+ALLOWED_SCHEMES = frozenset({'http', 'https'})
+# Links containing this pattern are neither collected nor crawled
+EXCLUDED_URL_PATTERN = "ld.php?content_id="
+# Playwright resource types that are not downloaded when rendering pages
+BLOCKED_RESOURCE_TYPES = frozenset({'image', 'stylesheet', 'font', 'media'})
+
+def filter_links(url, hrefs):
+    """
+    Resolves the href values found on url to absolute URLs, dropping links that should not be collected.
+    Returns a set of unique links.
+    """
+    links = set()
+    for href in hrefs:
+        # Skip empty links and in-page anchors
+        if not href or href[0] == '#':
+            continue
+        # Convert the relative URL to an absolute URL
+        absolute_url = urljoin(url, href)
+        # Keep only web links, which drops 'mailto:', 'javascript:', 'tel:' and similar schemes
+        if urlsplit(absolute_url).scheme not in ALLOWED_SCHEMES:
+            continue
+        # Skip URLs that contain "ld.php?content_id="
+        if EXCLUDED_URL_PATTERN not in absolute_url:
+            links.add(absolute_url)
+    return links
+
+def request_headers():
+    """
+    Builds request headers that identify the crawler as the GitHub Actions workflow,
+    matching check-urls.py, so requests are not rejected as an anonymous script and can be
+    filtered in server logs.
+    """
+    run_id = os.environ.get('GITHUB_RUN_ID', 'unknown')
+    workflow_name = os.environ.get('GITHUB_WORKFLOW', 'unknown')
+    repository = os.environ.get('GITHUB_REPOSITORY', 'unknown')
+    return {
+        'User-Agent': f'GitHubActionLibraryLinkChecker/1.0 (Run:{run_id}; Workflow:{workflow_name}; Repo:{repository})',
+        'X-GitHub-Action-Run': run_id,
+        'X-Workflow-Source': workflow_name,
+        'X-GitHub-Repository': repository,
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.5',
+    }
+
+async def fetch_links(session, url):
+    """
+    Asynchronously scrapes links from the specified URL using aiohttp and selectolax,
+    without rendering the page in a browser.
+    Returns a set of unique links found on the page.
+    """
+    try:
+        async with session.get(url) as response:
+            # Report pages that could not be fetched, so a blocked crawl is visible in the output
+            if not 200 <= response.status < 300:
+                print(f"Skipping {url}: HTTP status {response.status}")
+                return set()
+            # Only HTML pages contain links to collect, so skip downloading anything else
+            content_type = response.headers.get('Content-Type', '')
+            if 'html' not in content_type:
+                print(f"Skipping {url}: not HTML ({content_type or 'no Content-Type'})")
+                return set()
+            html = await response.text(errors='replace')
+            # Resolve relative links against the final URL after any redirects
+            page_url = str(response.url)
+        # Find the 'href' attribute of all <a> elements on the page
+        hrefs = (node.attributes.get('href') for node in LexborHTMLParser(html).css('a'))
+        return filter_links(page_url, hrefs)
+    except Exception as e:
+        print(f"Error getting links from {url}: {str(e)}")
+        return set()
+
 async def get_links(page, url):
     """
-    Asynchronously scrapes links from the specified URL using Playwright.
+    Asynchronously scrapes links from the specified URL using Playwright,
+    for sites that need JavaScript to render their links.
     Returns a set of unique links found on the page.
     """
-    links = set()
     try:
-        # Navigate to the URL and wait for the network to be idle
-        await page.goto(url, wait_until='networkidle')
-        # Find all <a> elements on the page
-        elements = await page.query_selector_all('a')
-        for element in elements:
-            # Get the 'href' attribute of each <a> element
-            href = await element.get_attribute('href')
-            # Filter out links that start with 'mailto:', '#', 'javascript:', or 'tel:'
-            if href and not href.startswith(('mailto:', '#', 'javascript:', 'tel:')):
-                # Convert the relative URL to an absolute URL
-                absolute_url = urljoin(url, href)
-                # Skip URLs that contain "ld.php?content_id="
-                if "ld.php?content_id=" not in absolute_url:
-                    links.add(absolute_url)
+        # Navigate to the URL and wait for the page and its scripts to load
+        await page.goto(url, wait_until='load')
+        # Get the 'href' attribute of all <a> elements on the page in a single round-trip
+        hrefs = await page.eval_on_selector_all('a[href]', "els => els.map(e => e.getAttribute('href'))")
+        # Resolve relative links against the final URL after any redirects
+        return filter_links(page.url, hrefs)
     except Exception as e:
         print(f"Error getting links from {url}: {str(e)}")
-    return links
+        return set()
+
+async def block_assets(route):
+    """
+    Aborts requests for resources that are not needed to find links on a page.
+    """
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+def open_seen_db(path):
+    """
+    Opens the SQLite database used to record which URLs the crawl has already queued,
+    at what depth, and whether they have been crawled, starting from an empty table.
+    """
+    con = sqlite3.connect(path)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('PRAGMA synchronous=NORMAL')
+    con.execute('DROP TABLE IF EXISTS seen')
+    con.execute('CREATE TABLE seen (url TEXT PRIMARY KEY, depth INTEGER NOT NULL, crawled INTEGER NOT NULL DEFAULT 0)')
+    con.commit()
+    return con
+
+def mark_seen(con, url, depth):
+    """
+    Records url as seen at depth, keeping the shallowest depth it was found at.
+    Returns True if it had not been seen before or was only seen deeper, so it should be queued.
+    """
+    return con.execute(
+        'INSERT INTO seen (url, depth) VALUES (?, ?) '
+        'ON CONFLICT(url) DO UPDATE SET depth = excluded.depth WHERE excluded.depth < seen.depth',
+        (url, depth)
+    ).rowcount == 1
 
-async def crawl_site(base_url, recurse=False, max_links=10000, max_depth=5):
+def start_crawl(con, url, depth):
+    """
+    Marks url as crawled before it is fetched.
+    Returns None if url has since been queued at a shallower depth (so this queue entry is stale),
+    otherwise True if this is the first crawl of url and False if it is being crawled again.
+    """
+    seen_depth, crawled = con.execute('SELECT depth, crawled FROM seen WHERE url = ?', (url,)).fetchone()
+    if seen_depth < depth:
+        return None
+    con.execute('UPDATE seen SET crawled = 1 WHERE url = ?', (url,))
+    return not crawled
+
+async def crawl_site(base_url, recurse=False, max_links=10000, max_depth=5, concurrency=4, js=False, state_db=':memory:'):
     """
     Crawls the site starting from the base_url.
     If recurse is True, it will follow links within the same domain.
+    Pages are fetched by a pool of `concurrency` workers sharing one frontier queue.
+    If js is True, pages are rendered in Playwright browser tabs; otherwise plain HTML is fetched with aiohttp.
+    URLs already queued are tracked in the SQLite database at state_db rather than in memory.
     Limits the number of links to prevent memory issues.
     """
-    async with async_playwright() as p:
-        browser = await p.chromium.launch()
-        page = await browser.new_page()
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+
+    async with AsyncExitStack() as stack:
+        seen = open_seen_db(state_db)
+        stack.callback(seen.close)
+        if js:
+            # Playwright is only needed for rendering, so the default path works without it installed
+            from playwright.async_api import async_playwright
+            p = await stack.enter_async_context(async_playwright())
+            browser = await p.chromium.launch()
+            stack.push_async_callback(browser.close)
+            # Links only need the document and its scripts, so skip downloading other assets
+            context = await browser.new_context()
+            await context.route('**/*', block_assets)
+            fetchers = [partial(get_links, await context.new_page()) for _ in range(concurrency)]
+        else:
+            session = await stack.enter_async_context(aiohttp.ClientSession(timeout=ClientTimeout(total=30), headers=request_headers()))
+            fetchers = [partial(fetch_links, session)] * concurrency
         
-        visited = set()
-        to_visit = [(base_url, 0)]  # (url, depth)
+        to_visit = asyncio.Queue()  # (url, depth)
+        # Each URL is recorded with its depth when queued; it is queued again only if later found
+        # at a shallower depth, so the pages crawled within max_depth do not depend on worker timing
+        mark_seen(seen, base_url, 0)
+        to_visit.put_nowait((base_url, 0))
+        found = asyncio.Queue()  # Lists of (link, parent) pairs from each crawled page
         all_links = []
+        total_links = 0
+        stop = False
         base_domain = urlparse(base_url).netloc
 
-        while to_visit and len(all_links) < max_links:
-            url, depth = to_visit.pop(0)
-            
-            # Skip URLs that have already been visited, contain "ld.php?content_id=", or exceed the maximum depth
-            if url in visited or "ld.php?content_id=" in url or depth >= max_depth:
-                continue
-            
-            visited.add(url)
-            links = await get_links(page, url)
-            
-            for link in links:
-                all_links.append((link, url))
-                # If recursing, add new links to the to_visit list if they are within the same domain and haven't been visited
-                if recurse and urlparse(link).netloc == base_domain and link not in visited:
-                    to_visit.append((link, depth + 1))
-            
-            # Write links to file in batches to save memory
-            if len(all_links) >= 1000:
-                yield all_links
-                all_links = []
+        async def worker(fetch):
+            while True:
+                url, depth = await to_visit.get()
+                try:
+                    # Skip URLs that contain "ld.php?content_id=", or exceed the maximum depth
+                    if stop or EXCLUDED_URL_PATTERN in url or depth >= max_depth:
+                        continue
+                    
+                    # Skip entries superseded by a shallower one for the same URL
+                    first_crawl = start_crawl(seen, url, depth)
+                    if first_crawl is None:
+                        continue
+                    
+                    links = await fetch(url)
+                    
+                    for link in links:
+                        # If recursing, add links within the same domain to the to_visit queue unless already queued at the same or a shallower depth
+                        if recurse and urlparse(link).netloc == base_domain and mark_seen(seen, link, depth + 1):
+                            to_visit.put_nowait((link, depth + 1))
+                    # A page crawled again at a shallower depth only passes on depths; its links were already collected
+                    if first_crawl:
+                        found.put_nowait([(link, url) for link in links])
+                finally:
+                    to_visit.task_done()
 
-        # Yield any remaining links
-        if all_links:
-            yield all_links
+        async def finish():
+            # The frontier is exhausted once every queued URL has been processed
+            await to_visit.join()
+            found.put_nowait(None)
 
-        await browser.close()
+        workers = [asyncio.create_task(worker(fetch)) for fetch in fetchers]
+        finisher = asyncio.create_task(finish())
+        try:
+            while True:
+                page_links = await found.get()
+                if page_links is None:
+                    break
+                all_links.extend(page_links)
+                # Count every link collected, since all_links is emptied after each batch
+                total_links += len(page_links)
+                if total_links >= max_links:
+                    stop = True
+                
+                # Write links to file in batches to save memory
+                if len(all_links) >= 1000:
+                    seen.commit()
+                    yield all_links
+                    all_links = []
+
+            # Yield any remaining links
+            if all_links:
+                yield all_links
+        finally:
+            finisher.cancel()
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(finisher, *workers, return_exceptions=True)
 
 async def main():
     parser = argparse.ArgumentParser(description="Crawl a website and collect links.")
     parser.add_argument("--recurse", action="store_true", help="Recursively crawl the site")
     parser.add_argument("--max-depth", type=int, default=5, help="Maximum depth for recursive crawling")
+    parser.add_argument("--max-links", type=int, default=10000, help="Stop crawling new pages once this many links are collected")
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of pages to load in parallel")
+    parser.add_argument("--js", action="store_true", help="Render pages with Playwright for sites that need JavaScript")
     parser.add_argument("--format", choices=["CSV"], default="CSV", help="Output format")
     args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
 
     # Get the base URL from the environment variable, or use a default value
     base_url = os.environ.get('BASE_URL') or "https://library.soton.ac.uk"
@@ -96,6 +271,7 @@ async def main():
     # Generate the filename for the CSV file based on the current date
     date = datetime.now().strftime('%Y-%m-%d')
     links_file = f"reports/get-links-{date}.csv"
+    state_db = f"reports/crawl-state-{date}.db"
 
 
     if args.format == "CSV":
@@ -103,9 +279,34 @@ async def main():
             writer = csv.writer(csvfile)
             writer.writerow(["URL", "Parent URL"])
             
-            # Crawl the site and write the collected links to the CSV file in batches
-            async for links_batch in crawl_site(base_url, args.recurse, max_depth=args.max_depth):
+            # Crawl the site in a separate task so crawling continues while batches are written;
+            # the bounded queue holds at most a few batches if writing falls behind
+            batches = asyncio.Queue(maxsize=4)
+
+            async def produce():
+                try:
+                    async for links_batch in crawl_site(base_url, args.recurse, max_links=args.max_links, max_depth=args.max_depth, concurrency=args.concurrency, js=args.js, state_db=state_db):
+                        await batches.put(links_batch)
+                finally:
+                    await batches.put(None)  # Signal that crawling has finished
+
+            producer = asyncio.create_task(produce())
+
+            # Write the collected links to the CSV file in batches
+            links_written = 0
+            while True:
+                links_batch = await batches.get()
+                if links_batch is None:
+                    break
                 writer.writerows(links_batch)
+                links_written += len(links_batch)
+            await producer  # Propagate any error raised while crawling
+
+            if not links_written:
+                print(f"Warning: no links were collected from {base_url}")
+
+        # The crawl state is only needed while crawling
+        os.remove(state_db)
     
     # Set the LINKS_FILE environment variable for GitHub Actions
     print(f"LINKS_FILE={links_file}")
@@ -115,4 +316,10 @@ async def main():
         print(f"Links saved to get-links-{date}.csv")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # Use the libuv-based event loop where available (uvloop does not support Windows)
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(main())
+    else:
+        uvloop.run(main())